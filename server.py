@@ -1,15 +1,215 @@
 from fastmcp import FastMCP
+import collections
 import os
 import re
 import subprocess
+import threading
 import xml.etree.ElementTree as ET
+import itertools
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import fnmatch
+import functools
 import json
+import shutil
+
+import pygit2
+from lxml import etree
+from pygit2.enums import FileStatus
+
+try:
+    import orjson  # optional: faster JSON for fix proposals
+except ImportError:
+    orjson = None
 
 mcp = FastMCP("Testing Agent 🚀")
 
+# Status bits that mean "this path has changes recorded in the index".
+_INDEX_FLAGS = (
+    FileStatus.INDEX_NEW | FileStatus.INDEX_MODIFIED | FileStatus.INDEX_DELETED
+    | FileStatus.INDEX_RENAMED | FileStatus.INDEX_TYPECHANGE
+)
+# Status bits for changes in the work tree that are not staged (including untracked files).
+_WT_FLAGS = (
+    FileStatus.WT_NEW | FileStatus.WT_MODIFIED | FileStatus.WT_DELETED
+    | FileStatus.WT_RENAMED | FileStatus.WT_TYPECHANGE | FileStatus.WT_UNREADABLE
+)
+
+# Class-level LINE counters with at least one missed line (JaCoCo: package -> class -> counter)
+_UNCOV_XPATH = etree.XPath("//package/class/counter[@type='LINE' and number(@missed) > 0]")
+
+
+# Commands whose (potentially huge) output is streamed and truncated instead of buffered
+_STREAMED_COMMANDS = {"mvn"}
+_STREAM_MAX_LINES = 2000
+
+
+def _run_streaming(cmd: List[str], cwd: str = None, max_lines: int = _STREAM_MAX_LINES) -> Dict[str, Any]:
+    """Run `cmd` with stderr merged into stdout, keeping only the last `max_lines` lines.
+
+    Output is consumed line by line while the process runs, so memory stays bounded
+    however much a long build prints.
+    """
+    try:
+        proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, encoding="utf-8", errors="replace", bufsize=1)
+    except FileNotFoundError as e:
+        return {"ok": False, "returncode": 127, "stdout": "", "stderr": str(e)}
+    with proc:
+        tail = collections.deque(proc.stdout, maxlen=max_lines)
+    return {"ok": proc.returncode == 0, "returncode": proc.returncode, "stdout": "".join(tail), "stderr": ""}
+
+
+def _run_cmd(cmd: List[str], cwd: str = None) -> Dict[str, Any]:
+    """Run `cmd` and return {ok, returncode, stdout, stderr}.
+
+    A missing executable is reported as returncode 127 instead of raising.
+    Long-running build commands (see `_STREAMED_COMMANDS`) go through `_run_streaming`.
+    """
+    if os.path.basename(cmd[0]) in _STREAMED_COMMANDS:
+        return _run_streaming(cmd, cwd=cwd)
+    try:
+        res = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    except FileNotFoundError as e:
+        return {"ok": False, "returncode": 127, "stdout": "", "stderr": str(e)}
+    return {"ok": res.returncode == 0, "returncode": res.returncode, "stdout": res.stdout, "stderr": res.stderr}
+
+
+class GitSession:
+    """Long-lived pygit2 handle on a repository, reused across tool calls.
+
+    Read-only queries (status, staged files, current branch) run in-process;
+    mutating operations (add, commit, push) still go through `_run_cmd`.
+    Tools run on FastMCP worker threads and libgit2 repositories/indexes are not
+    thread-safe, so every query holds the session lock. Queries raise
+    `pygit2.GitError` if the repository has gone away.
+    """
+
+    def __init__(self, git_dir: str):
+        self.repo = pygit2.Repository(git_dir)
+        self.workdir = os.path.normpath(self.repo.workdir)
+        self.lock = threading.Lock()
+
+    def status(self) -> Dict[str, int]:
+        """Return {path: FileStatus flags} for every modified, staged or untracked path."""
+        with self.lock:
+            return self.repo.status()
+
+    def staged_files(self) -> List[str]:
+        """Return paths with changes staged in the index (index diffed against HEAD)."""
+        with self.lock:
+            index = self.repo.index
+            index.read(False)  # reload only if `git add` changed it on disk
+            if self.repo.head_is_unborn:
+                # Nothing committed yet: every index entry is staged
+                return [entry.path for entry in index]
+            diff = index.diff_to_tree(self.repo.head.peel(pygit2.Tree))
+            return [delta.new_file.path for delta in diff.deltas]
+
+    def current_branch(self) -> Optional[str]:
+        """Return the checked-out branch name ("HEAD" when detached)."""
+        with self.lock:
+            if self.repo.head_is_unborn:
+                # No commits yet: HEAD is a symbolic ref to a branch that does not exist
+                return self.repo.references["HEAD"].target.removeprefix("refs/heads/")
+            return self.repo.head.shorthand
+
+
+@functools.lru_cache(maxsize=64)
+def _resolve_repo(repo_dir: str) -> str:
+    """Return the absolute form of `repo_dir`, memoized (the server never changes cwd)."""
+    return os.path.abspath(repo_dir)
+
+
+_GIT_SESSIONS: Dict[str, GitSession] = {}
+_GIT_SESSIONS_LOCK = threading.Lock()
+
+
+def _git_session(repo_dir: str) -> Optional[GitSession]:
+    """Return the cached GitSession for `repo_dir`, or None if it is not inside a work tree."""
+    key = _resolve_repo(repo_dir)
+    with _GIT_SESSIONS_LOCK:
+        session = _GIT_SESSIONS.get(key)
+        if session is None:
+            try:
+                git_dir = pygit2.discover_repository(key)
+                if git_dir is None or pygit2.Repository(git_dir).is_bare:
+                    return None
+                session = GitSession(git_dir)
+            except pygit2.GitError:
+                return None
+            _GIT_SESSIONS[key] = session
+    return session
+
+
+def _git_session_error(repo_dir: str, exc: Exception) -> Dict[str, Any]:
+    """Drop the (now stale) cached session for `repo_dir` and return the standard not-ok result."""
+    with _GIT_SESSIONS_LOCK:
+        _GIT_SESSIONS.pop(_resolve_repo(repo_dir), None)
+    return {"ok": False, "msg": f"Git error in {repo_dir}: {exc}"}
+
+
+def _jacoco_cache_key(p: Path) -> Tuple[str, int, int]:
+    """Return (abspath, mtime_ns, size) for `p`: a regenerated report gets a new key."""
+    st = p.stat()
+    return os.path.abspath(p), st.st_mtime_ns, st.st_size
+
+
+# One entry per report path, shared by git_commit(include_coverage) and analyze_coverage:
+# abspath -> ((mtime_ns, size), {"covered", "missed"[, "uncovered"]})
+_JACOCO_CACHE: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+
+
+def _jacoco_entry(p: Path) -> Dict[str, Any]:
+    """Return the cached entry for the current revision of report `p`, starting a fresh one if it changed."""
+    path, mtime_ns, size = _jacoco_cache_key(p)
+    cached = _JACOCO_CACHE.get(path)
+    if cached is None or cached[0] != (mtime_ns, size):
+        cached = ((mtime_ns, size), {})
+        _JACOCO_CACHE[path] = cached
+    return cached[1]
+
+
+def _jacoco_line_totals(path: Path) -> Tuple[int, int]:
+    """Stream a JaCoCo XML report and return (covered, missed) from its report-level LINE counter.
+
+    Only the counter directly under <report> is read (it already aggregates every
+    package/class below it); elements are cleared as they close, so memory stays flat.
+    """
+    depth = 0
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and elem.tag == "counter" and elem.get("type") == "LINE":
+            return int(elem.get("covered")), int(elem.get("missed"))
+        elem.clear()
+    return 0, 0
+
+
+def _load_jacoco(path: Path, entry: Dict[str, Any]) -> None:
+    """Parse a JaCoCo XML report into `entry`: its line totals and its classes with missed lines."""
+    root = etree.parse(str(path)).getroot()
+    uncovered = []
+    for counter in _UNCOV_XPATH(root):
+        cls = counter.getparent()
+        pkg = cls.getparent()
+        uncovered.append({
+            'package': pkg.get('name'),
+            'class': cls.get('name'),
+            'missed': int(counter.get('missed')),
+            'covered': int(counter.get('covered'))
+        })
+    # Report-level LINE counter, the same one _jacoco_line_totals streams to
+    covered = missed = 0
+    for counter in root.iterchildren("counter"):
+        if counter.get("type") == "LINE":
+            covered, missed = int(counter.get("covered")), int(counter.get("missed"))
+            break
+    entry["covered"], entry["missed"] = covered, missed
+    entry["uncovered"] = tuple(uncovered)
+
 
 def _compute_jacoco_coverage(jacoco_xml_path: str) -> Dict[str, Any]:
     """Return overall line coverage percent from a JaCoCo XML report.
@@ -17,20 +217,17 @@ def _compute_jacoco_coverage(jacoco_xml_path: str) -> Dict[str, Any]:
     Returns {percent: float, covered: int, missed: int}
     """
     p = Path(jacoco_xml_path)
-    if not p.exists():
-        return {"ok": False, "msg": f"File not found: {jacoco_xml_path}"}
     try:
-        tree = ET.parse(p)
-        root = tree.getroot()
-        total_missed = 0
-        total_covered = 0
-        for counter in root.findall('.//counter'):
-            if counter.get('type') == 'LINE':
-                total_missed += int(counter.get('missed'))
-                total_covered += int(counter.get('covered'))
+        # Streaming, totals-only read unless analyze_coverage already parsed this revision
+        entry = _jacoco_entry(p)
+        if "covered" not in entry:
+            entry["covered"], entry["missed"] = _jacoco_line_totals(p)
+        total_covered, total_missed = entry["covered"], entry["missed"]
         total = total_missed + total_covered
         percent = (total_covered / total * 100.0) if total > 0 else 0.0
         return {"ok": True, "percent": percent, "covered": total_covered, "missed": total_missed}
+    except FileNotFoundError:
+        return {"ok": False, "msg": f"File not found: {jacoco_xml_path}"}
     except Exception as e:
         return {"ok": False, "msg": str(e)}
 
@@ -38,31 +235,67 @@ def _compute_jacoco_coverage(jacoco_xml_path: str) -> Dict[str, Any]:
 @mcp.tool
 def git_status(repo_dir: str = ".") -> Dict[str, Any]:
     """Return git status summary: clean, staged files, unstaged files, conflicts, branch."""
-    repo_dir = os.path.abspath(repo_dir)
-    res = _run_cmd(["git", "status", "--porcelain", "--branch"], cwd=repo_dir)
-    out = res.get("stdout", "")
-    lines = [l for l in out.splitlines() if l.strip()]
-    branch = None
+    repo_dir = _resolve_repo(repo_dir)
+    session = _git_session(repo_dir)
+    if session is None:
+        return {"ok": False, "msg": f"Not a git repository: {repo_dir}"}
+
+    try:
+        status = session.status()
+        branch = session.current_branch()
+    except pygit2.GitError as e:
+        return _git_session_error(repo_dir, e)
     staged = []
     unstaged = []
     conflicts = []
-    for ln in lines:
-        if ln.startswith("##"):
-            branch = ln[2:].strip()
-            continue
-        # porcelain: XY <path>
-        status = ln[:2]
-        path = ln[3:]
-        x, y = status[0], status[1]
-        if x == 'U' or y == 'U' or (x == 'A' and y == 'A'):
+    for path, flags in status.items():
+        # Conflicted paths are listed under staged and unstaged too, as porcelain did
+        conflicted = flags & FileStatus.CONFLICTED
+        if conflicted:
             conflicts.append(path)
-        if x != ' ':
+        if conflicted or flags & _INDEX_FLAGS:
             staged.append(path)
-        if y != ' ':
+        if conflicted or flags & _WT_FLAGS:
             unstaged.append(path)
 
     clean = (len(staged) == 0 and len(unstaged) == 0 and len(conflicts) == 0)
-    return {"ok": True, "clean": clean, "branch": branch, "staged": staged, "unstaged": unstaged, "conflicts": conflicts, "raw": out}
+    return {"ok": True, "clean": clean, "branch": branch, "staged": staged, "unstaged": unstaged, "conflicts": conflicts, "raw": {path: int(flags) for path, flags in status.items()}}
+
+
+# Build artifacts and editor files `git_add_all` skips by default.
+DEFAULT_EXCLUDES = (
+    "target/**", "**/target/**", "**/*.class", "**/*.jar", "*.log", "**/.idea/**", "**/.vscode/**", "**/*.pyc", "node_modules/**"
+)
+
+
+# "*.ext", "*/*.ext", "**/*.ext" -> path.endswith(".ext"); "dir/**" -> path.startswith("dir/")
+_SUFFIX_GLOB_RX = re.compile(r"^(?:\*\*?/)?\*(\.\w+)$")
+_DIR_GLOB_RX = re.compile(r"^([\w.-]+/)\*\*$")
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_excludes(patterns: tuple) -> Tuple[tuple, tuple, re.Pattern]:
+    """Split glob patterns into (suffixes, dir_prefixes, fallback_regex) with fnmatch semantics.
+
+    Simple suffix and top-level directory globs become str.endswith/startswith
+    tuples; everything else is compiled into one alternation regex.
+    """
+    suffixes = []
+    dir_prefixes = []
+    fallback = []
+    for pat in patterns:
+        if m := _SUFFIX_GLOB_RX.match(pat):
+            suffixes.append(m.group(1))
+        elif m := _DIR_GLOB_RX.match(pat):
+            dir_prefixes.append(m.group(1))
+        else:
+            fallback.append(fnmatch.translate(pat))
+    # An empty alternation would match everything; (?!) matches nothing
+    fallback_rx = re.compile("|".join(fallback) if fallback else r"(?!)")
+    return tuple(suffixes), tuple(dir_prefixes), fallback_rx
+
+
+_DEFAULT_EXCLUDES_COMPILED = _compile_excludes(DEFAULT_EXCLUDES)
 
 
 @mcp.tool
@@ -70,53 +303,67 @@ def git_add_all(repo_dir: str = ".", exclude_patterns: List[str] = None) -> Dict
     """Stage all changes intelligently, excluding common build artifacts.
 
     Returns list of staged files and counts. Uses `exclude_patterns` on file paths.
+    The returned `staged` list can be passed on to `git_commit(staged=...)`.
     """
-    repo_dir = os.path.abspath(repo_dir)
-    if exclude_patterns is None:
-        exclude_patterns = [
-            "target/**", "**/target/**", "**/*.class", "**/*.jar", "*.log", "**/.idea/**", "**/.vscode/**", "**/*.pyc", "node_modules/**"
-        ]
-
-    st = _run_cmd(["git", "status", "--porcelain"], cwd=repo_dir)
-    files = []
-    for ln in (st.get("stdout", "") or "").splitlines():
-        if not ln.strip():
-            continue
-        path = ln[3:]
-        skip = False
-        for pat in exclude_patterns:
-            if fnmatch.fnmatch(path, pat) or fnmatch.fnmatch(os.path.join(repo_dir, path), pat):
-                skip = True
-                break
-        if not skip:
-            files.append(path)
+    repo_dir = _resolve_repo(repo_dir)
+    session = _git_session(repo_dir)
+    if session is None:
+        return {"ok": False, "msg": f"Not a git repository: {repo_dir}"}
+
+    try:
+        status = session.status()
+    except pygit2.GitError as e:
+        return _git_session_error(repo_dir, e)
+    if not status:
+        # Clean tree: skip pattern compilation and filtering entirely
+        return {"ok": True, "staged": [], "msg": "No files to stage."}
+
+    excludes = _DEFAULT_EXCLUDES_COMPILED if exclude_patterns is None else _compile_excludes(tuple(exclude_patterns))
+
+    # Cheap suffix/prefix checks first, then one filterfalse pass of the fallback regex;
+    # survivors are re-checked joined with the work tree, which patterns like
+    # "**/.idea/**" need for top-level dirs.
+    suffixes, dir_prefixes, fallback_rx = excludes
+    prefix = os.path.join(session.workdir, "")
+    candidates = [path for path in status if not (path.endswith(suffixes) or path.startswith(dir_prefixes))]
+    files = [path for path in itertools.filterfalse(fallback_rx.match, candidates) if not fallback_rx.match(prefix + path)]
 
     if not files:
         return {"ok": True, "staged": [], "msg": "No files to stage after filtering."}
 
-    # Stage files
+    # Stage files (paths are relative to the work tree root)
     add_cmd = ["git", "add", "--"] + files
-    add_res = _run_cmd(add_cmd, cwd=repo_dir)
+    add_res = _run_cmd(add_cmd, cwd=session.workdir)
 
     # Confirm staged
-    staged_res = _run_cmd(["git", "diff", "--name-only", "--cached"], cwd=repo_dir)
-    staged_files = [l for l in (staged_res.get("stdout", "") or "").splitlines() if l.strip()]
+    try:
+        staged_files = session.staged_files()
+    except pygit2.GitError as e:
+        return _git_session_error(repo_dir, e)
 
     return {"ok": add_res.get("returncode") == 0, "staged": staged_files, "add_stdout": add_res.get("stdout"), "add_stderr": add_res.get("stderr")}
 
 
 @mcp.tool
-def git_commit(message: str, repo_dir: str = ".", include_coverage: bool = False, jacoco_xml: str = None, coverage_threshold: float = None) -> Dict[str, Any]:
+def git_commit(message: str, repo_dir: str = ".", include_coverage: bool = False, jacoco_xml: str = None, coverage_threshold: float = None, staged: List[str] = None) -> Dict[str, Any]:
     """Commit staged changes with a standardized message. Optionally append coverage stats.
 
     - If `include_coverage` and `jacoco_xml` provided, compute coverage and append to message.
     - If `coverage_threshold` provided and coverage < threshold, the commit will be aborted and returned as not-ok.
+    - If `staged` is provided (e.g. the list returned by `git_add_all`), it is used instead of re-reading the index.
     """
-    repo_dir = os.path.abspath(repo_dir)
+    repo_dir = _resolve_repo(repo_dir)
+
+    session = _git_session(repo_dir)
+    if session is None:
+        return {"ok": False, "msg": f"Not a git repository: {repo_dir}"}
 
     # Check staged
-    staged_res = _run_cmd(["git", "diff", "--name-only", "--cached"], cwd=repo_dir)
-    staged = [l for l in (staged_res.get("stdout", "") or "").splitlines() if l.strip()]
+    if staged is None:
+        try:
+            staged = session.staged_files()
+        except pygit2.GitError as e:
+            return _git_session_error(repo_dir, e)
     if not staged:
         return {"ok": False, "msg": "No staged changes to commit."}
 
@@ -127,13 +374,12 @@ def git_commit(message: str, repo_dir: str = ".", include_coverage: bool = False
         if cov.get("ok"):
             coverage_info = cov
             percent = cov.get("percent", 0.0)
-            final_message = f"{message} | Coverage: {percent:.2f}% ({cov.get('covered')}/{cov.get('covered')+cov.get('missed')})"
+            # Abort before building the message when the threshold is not met
             if coverage_threshold is not None and percent < coverage_threshold:
                 return {"ok": False, "msg": f"Coverage {percent:.2f}% below threshold {coverage_threshold}% - aborting commit.", "coverage": cov}
+            final_message = f"{message} | Coverage: {percent:.2f}% ({cov.get('covered')}/{cov.get('covered')+cov.get('missed')})"
         else:
             final_message = f"{message} | Coverage: unknown ({cov.get('msg')})"
-
-            final_message = f"{message} | Coverage: {percent:.2f}% ({cov.get('covered')}/{cov.get('total')})"
     std_msg = final_message
 
     commit_res = _run_cmd(["git", "commit", "-m", std_msg], cwd=repo_dir)
@@ -146,10 +392,16 @@ def git_push(remote: str = "origin", repo_dir: str = ".") -> Dict[str, Any]:
 
     Returns push output and remote URL if available.
     """
-    repo_dir = os.path.abspath(repo_dir)
+    repo_dir = _resolve_repo(repo_dir)
+    session = _git_session(repo_dir)
+    if session is None:
+        return {"ok": False, "msg": f"Not a git repository: {repo_dir}"}
+
     # determine current branch
-    br = _run_cmd(["git", "rev-parse", "--abbrev-ref", "HEAD"], cwd=repo_dir)
-    branch = (br.get("stdout") or "").strip()
+    try:
+        branch = session.current_branch()
+    except pygit2.GitError as e:
+        return _git_session_error(repo_dir, e)
     if not branch:
         return {"ok": False, "msg": "Cannot determine current branch."}
 
@@ -169,7 +421,7 @@ def git_pull_request(base: str = "main", title: str = None, body: str = None, re
 
     Returns PR URL on success. If `gh` is not available, returns guidance.
     """
-    repo_dir = os.path.abspath(repo_dir)
+    repo_dir = _resolve_repo(repo_dir)
     # Determine title/body defaults
     if not title:
         title = "[AUTO] Pull request: changes and tests"
@@ -177,8 +429,7 @@ def git_pull_request(base: str = "main", title: str = None, body: str = None, re
         body = "Automated PR created by MCP tools. Includes test or coverage updates when applicable.\n\nMetadata:\n"
 
     # Try GitHub CLI first
-    gh_check = _run_cmd(["gh", "--version"], cwd=repo_dir)
-    if gh_check.get("returncode") == 0:
+    if shutil.which("gh") is not None:
         cmd = ["gh", "pr", "create", "--base", base, "--title", title, "--body", body]
         pr_res = _run_cmd(cmd, cwd=repo_dir)
         if pr_res.get("returncode") == 0:
@@ -205,6 +456,10 @@ def maven_run(project_dir: str = "codebase", goals: List[str] = None) -> Dict[st
     return _run_cmd(cmd, cwd=project_dir)
 
 
+# Insertion anchors for configure_jacoco; preferred: <build><plugins>, then <build>, then </project>
+_POM_ANCHOR_RX = re.compile(r"<plugins>|<build>|</project>")
+
+
 @mcp.tool
 def configure_jacoco(project_dir: str = "codebase") -> Dict[str, Any]:
     """Ensure a basic JaCoCo plugin snippet exists in `pom.xml`.
@@ -221,11 +476,19 @@ def configure_jacoco(project_dir: str = "codebase") -> Dict[str, Any]:
     if "jacoco-maven-plugin" in text:
         return {"ok": True, "msg": "JaCoCo already configured in pom.xml"}
 
-    # Backup
+    # One scan finds the first occurrence of each insertion anchor
+    anchors = {}
+    for m in _POM_ANCHOR_RX.finditer(text):
+        anchors.setdefault(m.group(0), m)
+        if "<build>" in anchors and "<plugins>" in anchors:
+            break
+    if not anchors.keys() & {"<build>", "</project>"}:
+        return {"ok": False, "msg": "No <build> or </project> found in pom.xml"}
+
+    # Backup (the rename keeps the original bytes; no need to rewrite them)
     backup = pom.with_suffix('.xml.bak')
     if not backup.exists():
         pom.replace(backup)
-        backup.write_text(text, encoding="utf-8")
 
     # Minimal plugin snippet
     plugin_snippet = """
@@ -251,19 +514,43 @@ def configure_jacoco(project_dir: str = "codebase") -> Dict[str, Any]:
     """
 
     # Try to insert under <build><plugins>
-    if "<build>" in text:
-        if "<plugins>" in text:
-            text = text.replace("<plugins>", "<plugins>\n" + plugin_snippet, 1)
+    if "<build>" in anchors:
+        if "<plugins>" in anchors:
+            at, insert = anchors["<plugins>"].end(), "\n" + plugin_snippet
         else:
-            text = text.replace("<build>", "<build>\n  <plugins>\n" + plugin_snippet + "\n  </plugins>")
+            at, insert = anchors["<build>"].end(), "\n  <plugins>\n" + plugin_snippet + "\n  </plugins>"
     else:
         # Add a build section near the end
-        text = text.replace("</project>", "  <build>\n    <plugins>\n" + plugin_snippet + "\n    </plugins>\n  </build>\n</project>")
+        at, insert = anchors["</project>"].start(), "  <build>\n    <plugins>\n" + plugin_snippet + "\n    </plugins>\n  </build>\n"
 
-    pom.write_text(text, encoding="utf-8")
+    pom.write_text(text[:at] + insert + text[at:], encoding="utf-8")
     return {"ok": True, "msg": "Inserted JaCoCo plugin into pom.xml (backup created)"}
 
 
+# One pass over a Java source finds both the package declaration and public
+# method signatures (return type, name, params).
+_JAVA_RX = re.compile(
+    r"package\s+(?P<pkg>[\w.]+);"
+    r"|public\s+(?:static\s+)?(?P<ret>[\w<>\[\].]+)\s+(?P<name>\w+)\s*\((?P<params>[^)]*)\)"
+)
+# Skeleton placeholders that generate_tests fills in existing test files
+_FAIL_PLACEHOLDER_RX = re.compile(r"fail\(\s*\"Not yet implemented\"\s*\)\s*;")
+_TODO_RX = re.compile(r"//\s*TODO:.*")
+# Parameter types that get a non-null dummy argument
+_INT_TYPE_RX = re.compile(r"\b(int|long|short|byte)\b")
+_FLOAT_TYPE_RX = re.compile(r"\b(double|float)\b")
+_BOOL_TYPE_RX = re.compile(r"\b(boolean)\b")
+_CHAR_TYPE_RX = re.compile(r"\b(char)\b")
+
+
+def _iter_java_files(src_root: Path):
+    """Yield paths of `*.java` files under `src_root` using os.walk."""
+    for dirpath, _dirnames, filenames in os.walk(src_root):
+        for name in filenames:
+            if name.endswith(".java"):
+                yield os.path.join(dirpath, name)
+
+
 @mcp.tool
 def generate_tests(project_dir: str = "codebase", out_dir: str = None) -> Dict[str, Any]:
     """Generate simple JUnit test skeletons for public methods found in Java sources.
@@ -282,45 +569,45 @@ def generate_tests(project_dir: str = "codebase", out_dir: str = None) -> Dict[s
         return {"ok": False, "msg": f"Source root not found: {src_root}"}
 
     created = 0
-    # Capture return type, method name and params; also match 'static' in the declaration
-    method_rx = re.compile(r"public\s+(?:static\s+)?([\w<>\[\].]+)\s+(\w+)\s*\(([^)]*)\)")
-    package_rx = re.compile(r"package\s+([\w\.]+);")
-
     encoding_issues = []
+    # New test files are written after the scan so each output directory is created once
+    pending_writes = []
+    out_dirs = set()
 
-    for java_file in src_root.rglob("*.java"):
+    for java_file in _iter_java_files(src_root):
         # Robustly read files: try utf-8, fall back to latin-1 (common for Windows-1252 bytes)
         try:
-            text = java_file.read_text(encoding="utf-8")
+            with open(java_file, encoding="utf-8") as f:
+                text = f.read()
         except UnicodeDecodeError:
             try:
-                text = java_file.read_text(encoding="latin-1")
-                encoding_issues.append(str(java_file))
+                with open(java_file, encoding="latin-1") as f:
+                    text = f.read()
+                encoding_issues.append(java_file)
             except Exception:
                 # skip files we cannot read
                 continue
+        except OSError:
+            continue
 
-        pkg_match = package_rx.search(text)
-        package = pkg_match.group(1) if pkg_match else ""
-
+        package = ""
         methods = []
-        for m in method_rx.finditer(text):
-            ret_type = m.group(1)
-            mname = m.group(2)
-            mparams = m.group(3).strip()
+        for m in _JAVA_RX.finditer(text):
+            if m.group("pkg") is not None:
+                if not package:
+                    package = m.group("pkg")
+                continue
             decl_span = text[max(0, m.start() - 40):m.end() + 40]
-            is_static = 'static' in decl_span
-            methods.append({"name": mname, "params": mparams, "static": is_static})
+            methods.append({"name": m.group("name"), "params": m.group("params").strip(), "static": 'static' in decl_span})
 
         if not methods:
             continue
 
-        class_name = java_file.stem
+        class_name = os.path.basename(java_file)[:-len(".java")]
         test_class_name = class_name + "Test"
         # Determine output directory for package
         pkg_path = package.replace('.', os.sep) if package else ""
         out_dir_full = test_root / pkg_path
-        out_dir_full.mkdir(parents=True, exist_ok=True)
         test_file = out_dir_full / (test_class_name + ".java")
 
         # If file exists, attempt to fill TODOs / replace placeholder failures with a simple assertion
@@ -331,9 +618,9 @@ def generate_tests(project_dir: str = "codebase", out_dir: str = None) -> Dict[s
                 s = test_file.read_text(encoding="latin-1")
             s_new = s
             # Replace the common skeleton failure with a harmless placeholder assertion
-            s_new = re.sub(r"fail\(\s*\"Not yet implemented\"\s*\)\s*;", 'assertTrue(true, "placeholder - filled by generator");', s_new)
+            s_new = _FAIL_PLACEHOLDER_RX.sub('assertTrue(true, "placeholder - filled by generator");', s_new)
             # Replace simple TODO comments inside test methods (best-effort)
-            s_new = re.sub(r"//\s*TODO:.*", "// TODO: filled by generator - please refine", s_new)
+            s_new = _TODO_RX.sub("// TODO: filled by generator - please refine", s_new)
             if s_new != s:
                 test_file.write_text(s_new, encoding="utf-8")
             # do not create a new test file if one exists
@@ -361,13 +648,13 @@ def generate_tests(project_dir: str = "codebase", out_dir: str = None) -> Dict[s
                     else:
                         typ = toks[0]
                     typ = typ.strip()
-                    if re.search(r"\b(int|long|short|byte)\b", typ):
+                    if _INT_TYPE_RX.search(typ):
                         args.append('0')
-                    elif re.search(r"\b(double|float)\b", typ):
+                    elif _FLOAT_TYPE_RX.search(typ):
                         args.append('0.0')
-                    elif re.search(r"\b(boolean)\b", typ):
+                    elif _BOOL_TYPE_RX.search(typ):
                         args.append('false')
-                    elif re.search(r"\b(char)\b", typ):
+                    elif _CHAR_TYPE_RX.search(typ):
                         args.append("'a'")
                     else:
                         # For object types and arrays we pass null as a safe placeholder
@@ -392,7 +679,14 @@ def generate_tests(project_dir: str = "codebase", out_dir: str = None) -> Dict[s
             body_lines.append(test_method)
 
         body_lines.append("}\n")
-        test_file.write_text(''.join(body_lines), encoding="utf-8")
+        pending_writes.append((test_file, body_lines))
+        out_dirs.add(out_dir_full)
+
+    for d in out_dirs:
+        d.mkdir(parents=True, exist_ok=True)
+    for test_file, body_lines in pending_writes:
+        with test_file.open("w", encoding="utf-8", buffering=65536) as f:
+            f.writelines(body_lines)
         created += 1
 
     result = {"ok": True, "created_tests": created}
@@ -408,45 +702,23 @@ def analyze_coverage(project_dir: str = "codebase", jacoco_xml: str = None) -> D
     If `jacoco_xml` is None, search common locations under `project_dir/target`.
     """
     p = Path(project_dir)
-    candidates = []
     if jacoco_xml:
-        candidates = [Path(jacoco_xml)]
+        found = Path(jacoco_xml)
     else:
-        candidates = list(p.rglob("jacoco.xml")) + list(p.rglob("**/jacoco.xml"))
+        # Stop walking the tree at the first report
+        found = next(p.rglob("jacoco.xml"), None)
+        if found is None:
+            # common site location
+            found = p / "target" / "site" / "jacoco" / "jacoco.xml"
 
-    if not candidates:
-        # common site location
-        candidates = [p / "target" / "site" / "jacoco" / "jacoco.xml"]
-
-    found = None
-    for c in candidates:
-        if c.exists():
-            found = c
-            break
-
-    if not found:
+    if not found.exists():
         return {"ok": False, "msg": "JaCoCo XML report not found. Run Maven tests with JaCoCo enabled."}
 
-    tree = ET.parse(found)
-    root = tree.getroot()
-    uncovered = []
-    # JaCoCo XML: packages -> package -> class -> counter type="LINE"
-    for pkg in root.findall('.//package'):
-        pkg_name = pkg.get('name')
-        for cls in pkg.findall('class'):
-            cls_name = cls.get('name')
-            line_counter = None
-            for counter in cls.findall('counter'):
-                if counter.get('type') == 'LINE':
-                    missed = int(counter.get('missed'))
-                    covered = int(counter.get('covered'))
-                    if missed > 0:
-                        uncovered.append({
-                            'package': pkg_name,
-                            'class': cls_name,
-                            'missed': missed,
-                            'covered': covered
-                        })
+    entry = _jacoco_entry(found)
+    if "uncovered" not in entry:
+        _load_jacoco(found, entry)
+    # Copy the cached entries so callers cannot mutate the cache
+    uncovered = [dict(item) for item in entry["uncovered"]]
 
     recommendations = []
     for item in uncovered:
@@ -455,6 +727,31 @@ def analyze_coverage(project_dir: str = "codebase", jacoco_xml: str = None) -> D
     return {"ok": True, "report": {"file": str(found), "uncovered": uncovered, "recommendations": recommendations}}
 
 
+def _parse_surefire_file(xml_file: Path) -> List[Dict[str, Any]]:
+    """Return the failed/errored testcases of one Surefire XML report."""
+    failures = []
+    try:
+        # Stream testcases and drop each one once read, so memory stays per-testcase
+        for _, tc in ET.iterparse(xml_file, events=("end",)):
+            if tc.tag != 'testcase':
+                continue
+            # Explicit None checks: an Element without children is falsy, so `or` would skip it
+            failure = tc.find('failure')
+            if failure is None:
+                failure = tc.find('error')
+            if failure is not None:
+                classname = tc.get('classname')
+                name = tc.get('name')
+                message = failure.get('message') if failure.get('message') else ''
+                stack = failure.text or ''
+                failures.append({'classname': classname, 'name': name, 'message': message, 'stacktrace': stack})
+            tc.clear()
+    except Exception:
+        # ignore malformed files
+        return []
+    return failures
+
+
 def _parse_surefire_reports(project_dir: str = "codebase") -> Dict[str, Any]:
     """Parse Maven Surefire reports for test failures and stack traces.
 
@@ -466,21 +763,9 @@ def _parse_surefire_reports(project_dir: str = "codebase") -> Dict[str, Any]:
     if not reports_dir.exists():
         return results
 
-    for xml_file in reports_dir.glob("*.xml"):
-        try:
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            for tc in root.findall('.//testcase'):
-                failure = tc.find('failure') or tc.find('error')
-                if failure is not None:
-                    classname = tc.get('classname')
-                    name = tc.get('name')
-                    message = failure.get('message') if failure.get('message') else ''
-                    stack = failure.text or ''
-                    results['failures'].append({'classname': classname, 'name': name, 'message': message, 'stacktrace': stack})
-        except Exception:
-            # ignore malformed files
-            continue
+    # Parsed in-process: streaming a report takes well under a millisecond, far less
+    # than starting a worker that has to re-import this module (and fastmcp/pygit2/lxml)
+    results['failures'] = list(itertools.chain.from_iterable(map(_parse_surefire_file, reports_dir.glob("*.xml"))))
 
     return results
 
@@ -492,7 +777,10 @@ def _write_fix_proposal(failures: List[Dict[str, Any]], project_dir: str, iterat
     meta_path = base / f'proposal_{iteration}.json'
     patch_path = base / f'proposal_{iteration}.patch'
     meta = {'iteration': iteration, 'failures': failures}
-    meta_path.write_text(json.dumps(meta, indent=2), encoding='utf-8')
+    if orjson is not None:
+        meta_path.write_bytes(orjson.dumps(meta, option=orjson.OPT_INDENT_2))
+    else:
+        meta_path.write_text(json.dumps(meta, indent=2), encoding='utf-8')
     # Create a placeholder patch explaining the proposed fix steps
     patch_text = """# Proposal patch placeholder\n# This file contains suggested changes to fix failing tests found during iteration.\n# Inspect the failures in the .json file and edit this patch to include actual unified-diff content.\n"""
     patch_path.write_text(patch_text, encoding='utf-8')